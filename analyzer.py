@@ -2,6 +2,7 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 from utils.peakdetect import peakdetect
+from utils.physicshelper import freq2lamb
 
 class Analyzer:
     """ Superfish simulation result analyzer.
@@ -11,23 +12,80 @@ class Analyzer:
         self.core = core
         self.info = None
     
-    def _cal_flatness(self, Ez, lookahead=20):
+    def _cal_cell_edges(self):
+        ''' Calculate the cell boundaries of the gun made by Brain.make_gun.
+        
+        Returns:
+        edges -- the cell boundaries, cell_num+2 elements [cm].'''
+        edges = [0]
+        for element in self.core.generator.brain.gun:
+            paras = element['paras']
+            if element['type'] == 'halfcell':
+                edges.append(paras['l_half'])
+            elif element['type'] == 'fullcell':
+                edges.append(paras['p_start']+paras['l_full'])
+        return np.array(edges)
+
+    def _cal_peaks(self, Ez, z=None, lookahead=None):
+        ''' Find the field peak of every cell.
+        
+        With z given, the field is split at the cell boundaries and the peak of
+        each cell is the maximum of its segment, so there is always one peak per
+        cell. Otherwise, or with brain option peaks='adaptive', peakdetect runs
+        with a few lookaheads around the given one until the peak number matches.
+        
+        Keyword arguments:
+        Ez -- axial electric field in MV/m.
+        z -- [None] axial positions [cm], sample indices if None.
+        lookahead -- [None] peakdetect lookahead, a quarter cell if None.
+        
+        Returns:
+        peaks -- (position, peak) of the cells, None if the peak number doesn't match.'''
+        brain = self.core.generator.brain
+        num = int(brain.cell_num)+1  # number of cells
+        Ez = np.abs(Ez)
+        try:
+            method = brain.options['peaks']
+        except (TypeError, KeyError):
+            method = 'segment'
+
+        if method == 'segment' and z is not None:
+            idx = np.searchsorted(z, self._cal_cell_edges())
+            if len(idx) == num+1 and np.all(np.diff(idx) > 0):
+                pos = [start+np.argmax(Ez[start:end]) for start, end in zip(idx[:-1], idx[1:])]
+                return np.vstack((z[pos], Ez[pos])).transpose()
+
+        if lookahead is None:
+            if z is None:
+                lookahead = 20
+            else:
+                l_full = freq2lamb(brain.freq)*1e-1/2  # mm to cm
+                lookahead = max(1, int(len(z)*l_full/(z[-1]-z[0])/4))  # quarter cell
+        for factor in [1, 0.5, 2, 0.25, 4]:
+            _lookahead = max(1, int(lookahead*factor))
+            if _lookahead >= len(Ez):
+                continue
+            peaks = peakdetect(Ez, z, lookahead=_lookahead)[0]
+            if len(peaks) == num:
+                return np.array(peaks)
+        print("Peak number doesn't match cell number!")
+        return None
+
+    def _cal_flatness(self, Ez, z=None, lookahead=None):
         ''' Calculate the flatness of the e-gun.
         
         Keyword arguments:
         Ez -- axial electric field in MV/m.
+        z -- [None] axial positions [cm].
+        lookahead -- [None] peakdetect lookahead, see _cal_peaks.
         
         Returns:
         flatness -- flatness of the field.'''
-        num = int(self.core.generator.brain.cell_num)+1  # number of cells
-
-        peaks = peakdetect(Ez, lookahead=lookahead)[0]
-        if len(peaks) == num:
-            p_values = np.array(peaks)[:, 1]
-            return (p_values/p_values[0])[1:]
-        else:
-            print("Peak number doesn't match cell number!")
+        peaks = self._cal_peaks(Ez, z, lookahead)
+        if peaks is None:
             return np.nan
+        p_values = peaks[:, 1]
+        return (p_values/p_values[0])[1:]
 
     def analyze(self):
         ''' Read cavity physical parameters in a .SFO file.
@@ -92,11 +150,50 @@ class Analyzer:
             z, Ez = np.array(z), np.array(Ez)
             paras['nu'] = Ez[0]/np.max(Ez)
             paras['Emap'] = np.vstack((z, Ez/1e6))
-            paras['flat'] = self._cal_flatness(Ez)
+            paras['flat'] = self._cal_flatness(Ez, z)
             paras['name'] = sfo_output
 
         self.info = paras
 
+    def analyze_fast(self):
+        ''' Quick analysis for the inner loop of the seek. Only the frequency is
+        read from the .SFO file, the flatness comes from the SF7 axial line scan.
+        
+        Returns:
+        paras -- the dict of physical parameters.
+            name -- .SFO filename
+            f -- frequency [MHz]
+            flat -- flatness of the field
+            peaks -- positions of the cell peaks [cm]'''
+        root = '.'
+        brain = self.core.generator.brain
+        sim = brain.name
+        sim_path = os.path.join(root, sim)
+
+        sfo_output = [fname for fname in os.listdir(sim_path) if os.path.splitext(fname)[1] == '.SFO'][0]
+        paras = {'name': sfo_output}
+        with open(os.path.join(sim_path, sfo_output), 'r') as f:
+            flag = 0
+            for l in f:
+                if flag:
+                    tokens = l.split()
+                    if tokens and tokens[0] == 'Frequency':
+                        paras['f'] = float(tokens[2])
+                        break
+                elif l.startswith("All calculated values below refer to the mesh geometry only."):
+                    flag = 1
+
+        z, Ez = self.read_SF7()
+        peaks = self._cal_peaks(Ez, z)
+        if peaks is None:
+            paras['flat'] = np.nan
+            paras['peaks'] = np.nan
+        else:
+            paras['flat'] = (peaks[:, 1]/peaks[0, 1])[1:]
+            paras['peaks'] = peaks[:, 0]
+
+        self.info = paras
+
     def read_SF7(self):
         """ Read axial electric field data in the OUTSF7.TXT file that generated by superfish.
         
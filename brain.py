@@ -1,20 +1,44 @@
+import time
 import numpy as np
+from scipy.optimize import minimize
 from sfgenerator import SFGenerator
 from sfcore import SFCore
 from analyzer import Analyzer
 from utils.physicshelper import freq2lamb
 from utils.newton import seek_root
+from sfqueue import SFQueue
+from sfpipeline import SFPipeline
+from utils.monitor import make_event
+from utils.tolerance import tolerance_budget, mc_yield
 
 class Brain:
     """ e-Gun CPU.
     """
 
-    def __init__(self, freq=2856, cell_num=1.6, name='e-gun', options=None):
+    def __init__(self, freq=2856, cell_num=1.6, name='e-gun', options=None, geometry=None):
         self.freq = freq
         self.cell_num = cell_num
         self.name = name
         self.options = options
+        self.geometry = dict(geometry or {})  # overrides of r_tube, r_chamfer, l_drift [cm]
         self.gun = ''
+        self.stats = {}
+        self.info = None
+        self.x = None
+        self.y = None
+        self.jacobian = None
+        try:
+            queue = options['queue']  # root, or dict of SFQueue arguments
+        except (TypeError, KeyError):
+            self.queue = None
+        else:
+            self.queue = SFQueue(**queue) if isinstance(queue, dict) else SFQueue(queue)
+        try:
+            pipeline = options['pipeline']  # dict of SFPipeline arguments
+        except (TypeError, KeyError):
+            self.pipeline = None
+        else:
+            self.pipeline = SFPipeline(self, **pipeline)
 
     def _cal_drive_point(self):
         freq = self.freq
@@ -35,11 +59,12 @@ class Brain:
         # Gun geometry
         lamb = freq2lamb(freq)*1e-1  # mm to cm
         a = 2.405/(2*np.pi)*lamb  # [cm] matched cell radius
-        b = a/4  # tube radius
-        r = a/4  # chamfer/joint radius
+        geometry = self.geometry
+        b = geometry.get('r_tube', a/4)  # tube radius
+        r = geometry.get('r_chamfer', a/4)  # chamfer/joint radius
         l_full = lamb/2
         l_half = hc_ratio*l_full
-        l_drift = 1.2*l_full  # gun exit drift distance
+        l_drift = geometry.get('l_drift', 1.2*l_full)  # gun exit drift distance
         # Simulation settings
         name = self.name
         xdri, ydri = self._cal_drive_point()
@@ -98,21 +123,104 @@ class Brain:
         gun.append(drift)
         self.gun = gun
 
-    def test_gun(self, x):
+    def test_gun(self, x, fast=False):
+        """ Simulate the gun and measure its frequency and flatness errors.
+
+        Keyword arguments:
+        x -- cell radii.
+        fast -- [False] skip the full .SFO analysis, flatness comes from a
+            reduced SF7 line scan of options['sf7_num'] increments.
+
+        Returns:
+        y -- relative frequency error and flatness errors.
+        """
+        core, stats = self._solve_gun(x, fast)
+        t0 = time.time()
+        analyzer = Analyzer(core)
+        if fast:
+            analyzer.analyze_fast()
+        else:
+            analyzer.analyze()
+        self.info = analyzer.info
+        stats['t_analyze'] = time.time()-t0
+        self.stats = stats
+        # analyzer.plot_efield(False, True)
+        return self._cal_err(analyzer.info)
+
+    def _solve_gun(self, x, fast=False):
+        """ Generate the superfish input files of the gun and run the solver.
+
+        Keyword arguments:
+        x -- cell radii.
+        fast -- [False] generate the reduced SF7 line scan, see test_gun.
+
+        Returns:
+        core -- the SFCore that ran the simulation.
+        stats -- generation and solver time. [s]
+        """
+        t0 = time.time()
         self.make_gun(x)
         generator = SFGenerator(self)
         generator.gen_af()
-        generator.gen_sf7()
+        if fast:
+            try:
+                generator.gen_sf7(self.options['sf7_num'])
+            except (TypeError, KeyError):
+                generator.gen_sf7()
+        else:
+            generator.gen_sf7()
+        t1 = time.time()
         core = SFCore(generator)
         core.run()
-        analyzer = Analyzer(core)
-        analyzer.analyze()
-        # analyzer.plot_efield(False, True)
-        freq = analyzer.info['f']/self.freq-1
-        flat = analyzer.info['flat']-1
+        t2 = time.time()
+        return core, {'t_gen': t1-t0, 't_solve': t2-t1}
+
+    def _cal_err(self, info):
+        freq = info['f']/self.freq-1
+        flat = info['flat']-1
         y = np.append(freq, flat)
         return y
 
+    def test_guns(self, xs, callback=None, fast=False):
+        """ Test several guns, on the queue workers if a queue is given,
+        otherwise through the post-processing pipeline if one is given and
+        there is more than one gun. self.info is only kept for guns tested
+        one by one on this host.
+
+        Keyword arguments:
+        xs -- list of cell radii.
+        callback -- [None] function called with a dict event after every evaluation.
+        fast -- [False] use the fast analysis, see test_gun.
+
+        Returns:
+        ys -- list of test_gun results.
+        """
+        t0 = time.time()
+        if self.queue is None and self.pipeline is not None and len(xs) > 1:
+            ys = self.pipeline.map(xs, fast)
+            self.info = None  # the analysis stays on the pipeline slots
+            if callback is not None:
+                for x, y, stats in zip(xs, ys, self.pipeline.stats):
+                    callback(make_event('evaluation', x=np.asarray(x, dtype=float), y=y,
+                                        time=sum(stats.values()), stats=stats))
+        elif self.queue is None:
+            ys = []
+            for x in xs:
+                ys.append(self.test_gun(x, fast))
+                if callback is not None:
+                    t1 = time.time()
+                    callback(make_event('evaluation', x=np.asarray(x, dtype=float), y=ys[-1],
+                                        time=t1-t0, stats=self.stats))
+                    t0 = t1
+        else:
+            ys = self.queue.map(self, xs, fast)
+            self.info = None  # the analysis stays on the workers
+            if callback is not None:
+                for x, y, stats in zip(xs, ys, self.queue.stats):
+                    callback(make_event('evaluation', x=np.asarray(x, dtype=float), y=y,
+                                        time=sum(stats.values()), stats=stats))
+        return ys
+
     def _init_guess(self):
         lamb = freq2lamb(self.freq)*1e-1  # mm to cm
         a = 2.405/(2*np.pi)*lamb
@@ -120,25 +228,174 @@ class Brain:
         x = [a]*cnum
         return x
 
-    def seek(self):
+    def seek(self, callback=None, x0=None):
+        """ Tune the cell radii for the target frequency and a flat field.
+
+        Keyword arguments:
+        callback -- [None] function called with a dict event after every
+            evaluation and every cycle. If it ever returns True the seek stops
+            at the end of the current cycle. See utils.monitor for stock callbacks.
+        x0 -- [None] initial cell radii, _init_guess if None.
+
+        With options['fast'] the cycles use the fast analysis, and the full
+        analysis only runs on the final guess, on the queue workers if a queue
+        is given. Its err is returned, its Analyzer.info is kept in self.info
+        only if it ran on this host.
+        The final guess, its err and Jacobian are kept in self.x, self.y and self.jacobian.
+
+        Returns:
+        x -- final cell radii
+        y -- final err
+        """
+        stop = []
+
+        def emit(event):
+            if callback is not None and callback(event):
+                stop.append(event['event'])
+            return bool(stop)
+
         try:
             step = self.options['step']
         except KeyError:
             step = 1e-3
-        
-        def jacob(x):
-            y = self.test_gun(x)
-            mat = []
+        try:
+            fast = self.options['fast']
+        except KeyError:
+            fast = False
+
+        def jacob(x, y=None):
+            xs = [np.copy(x) for i in range(len(x)+1)]
             for i in range(len(x)):
-                _x = np.copy(x)
-                _x[i] += step
-                _y = self.test_gun(_x)
-                mat.append((_y-y)/step)
-            mat = np.array(mat).transpose()
+                xs[i+1][i] += step
+            if y is None:
+                ys = self.test_guns(xs, emit, fast)
+            else:  # value at x is known already
+                ys = [y]+self.test_guns(xs[1:], emit, fast)
+            y = ys[0]
+            mat = np.array([(_y-y)/step for _y in ys[1:]]).transpose()
+            self.jacobian = mat
             return y, mat
 
-        x = self._init_guess()
-        seek_root(x, jacob, self.options)
+        def func(x):
+            return self.test_guns([x], emit, fast)[0]
+
+        x = self._init_guess() if x0 is None else x0
+        x, y = seek_root(x, jacob, self.options, emit, func)
+        if fast:
+            y = self.test_guns([x], emit)[0]
+        self.x = x
+        self.y = y
+        return x, y
+
+    def refine_jacobian(self, step=None):
+        """ Refine the Jacobian of the final guess of seek with central differences.
+
+        The 2N guns are tested in one batch, in parallel if a queue is given.
+
+        Keyword arguments:
+        step -- [None] difference step, options['step'] if None.
+
+        Returns:
+        mat -- the refined Jacobian matrix.
+        """
+        if step is None:
+            try:
+                step = self.options['step']
+            except KeyError:
+                step = 1e-3
+        try:
+            fast = self.options['fast']
+        except KeyError:
+            fast = False
+
+        x = np.asarray(self.x, dtype=float)
+        xs = [x+step*e for e in np.eye(len(x))]+[x-step*e for e in np.eye(len(x))]
+        ys = np.array(self.test_guns(xs, fast=fast))
+        mat = ((ys[:len(x)]-ys[len(x):])/(2*step)).transpose()
+        self.jacobian = mat
+        return mat
+
+    def analyze_tolerance(self, ytol, sigma=None, refine=True, samples=100000, seed=None):
+        """ Linearized tolerance analysis of the cell radii around the final guess of seek.
+
+        Keyword arguments:
+        ytol -- allowed error of the relative frequency and the flatness, float or array.
+        sigma -- [None] rms machining error of the radii [cm], the budget if None.
+        refine -- [True] refine the Jacobian with central differences first.
+        samples -- [100000] number of Monte-Carlo samples.
+        seed -- [None] random seed of the Monte-Carlo.
+
+        Returns:
+        result -- the dict of the tolerance analysis.
+            jacobian -- the Jacobian matrix
+            budget -- tolerance of every cell radius [cm]
+            yield -- fraction of the guns within ytol, including the err left by seek
+            dy -- errors of the Monte-Carlo guns, samples x outputs
+        """
+        if refine:
+            self.refine_jacobian()
+        mat = self.jacobian
+        budget = tolerance_budget(mat, ytol)
+        if sigma is None:
+            sigma = budget
+        ratio, dy = mc_yield(mat, sigma, ytol, self.y, samples, seed)
+        return {
+            'jacobian': mat,
+            'budget': budget,
+            'yield': ratio,
+            'dy': dy}
+
+    def optimize(self, paras, objective, targets=None, penalty=1e3, make_callback=None, maxiter=50):
+        """ Tune the extra geometry parameters for the objective. At every outer
+        step the cell radii are retuned by seek for the frequency and the flatness,
+        warm started from the cell radii of the previous step.
+
+        Keyword arguments:
+        paras -- dict of the geometry parameters to tune, name: (initial, lower, upper).
+            name is 'r_tube', 'r_chamfer' or 'l_drift', all units are cm.
+        objective -- dict of the weights of the Analyzer.info values to minimize.
+            ex. {'ZTT': -1, 'eta': 0.1}
+        targets -- [None] dict of extra equality targets on Analyzer.info values.
+            ex. {'nu': 0.5}
+        penalty -- [1e3] weight of the squared relative errors of targets and seek.
+        make_callback -- [None] function without arguments that returns a new seek
+            callback, called before every seek so that stateful predicates such as
+            utils.monitor.no_improvement start afresh. See seek.
+        maxiter -- [50] outer iteration limitation.
+
+        The objective needs the Analyzer.info of the final guess of every seek,
+        which is not sent back by the queue workers. With a queue the full
+        analysis of every outer step runs once more locally, so this host needs
+        a superfish installation too.
+
+        Returns:
+        result -- the scipy.optimize.OptimizeResult of the outer optimization.
+        """
+        targets = targets or {}
+        try:
+            fast = self.options['fast']
+        except KeyError:
+            fast = False
+        names = list(paras)
+        p0 = [paras[name][0] for name in names]
+        bounds = [paras[name][1:] for name in names]
+
+        def cost(p):
+            self.geometry.update(zip(names, [float(v) for v in p]))
+            callback = None if make_callback is None else make_callback()
+            x, y = self.seek(callback, self.x)
+            if self.info is None or not fast:  # seek keeps the full analysis of x in self.info if it ran locally
+                self.test_gun(x)
+            info = self.info
+            c = sum([weight*info[key] for key, weight in objective.items()])
+            c += penalty*sum([(info[key]/value-1)**2 for key, value in targets.items()])
+            c += penalty*np.sum(y**2)  # err left by seek
+            print('Outer: {0} -> {1}'.format(dict(zip(names, p)), c))
+            return c
+
+        result = minimize(cost, p0, method='Powell', bounds=bounds, options={'maxiter': maxiter})
+        self.geometry.update(zip(names, [float(v) for v in result.x]))
+        return result
 
 if __name__ == "__main__":
     options = {
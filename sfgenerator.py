@@ -1,6 +1,6 @@
 import os
 from subprocess import Popen, PIPE
-from utils.gencell import gen_halfcell, gen_fullcell, gen_drift, gen_setting, gen_title
+from utils.gencell import write_gun
 
 class SFGenerator:
     """ Superfish input file Generator.
@@ -15,21 +15,16 @@ class SFGenerator:
         name = self.brain.name
         gun = self.brain.gun
 
-        gen_element = {
-            'title': gen_title,
-            'setting': gen_setting, 
-            'halfcell': gen_halfcell,
-            'fullcell': gen_fullcell,
-            'drift': gen_drift}
-        ctx = '\n\n'.join([gen_element[element['type']](element['paras']) for element in gun])
-
         self._gen_sim_folder()
         self._clean_up_sim_folder()
         with open(os.path.join('.', name, name+'.af'), 'w') as f:
-            f.write(ctx)
+            write_gun(f, gun)
 
-    def gen_sf7(self):
+    def gen_sf7(self, num=None):
         """ Generate the sf7 input file of the rf gun.
+
+        Keyword arguments:
+        num -- [None] number of increments of the axial line, 2 per mesh if None.
         """
         name = self.brain.name
         gun = self.brain.gun  # gun = [title, setting, halfcell, fullcell..., drift]
@@ -38,7 +33,8 @@ class SFGenerator:
         drift = gun[-1]
         dx = setting['paras']['dx']
         z_end = drift['paras']['p_start']+drift['paras']['l_drift']
-        num = int(2*z_end/dx)
+        if num is None:
+            num = int(2*z_end/dx)
         
         ctx = '''Line
 {0:.4f} {2:.4f} {1:.4f} {2:.4f}
@@ -0,0 +1,128 @@
+import copy
+import time
+import threading
+from queue import Queue
+from analyzer import Analyzer
+
+class SFPipeline:
+    """ Pipelined gun evaluation.
+
+    The solver runs on the calling thread, one gun after another. Parsing,
+    field map export and plotting of a solved gun run on a pool of threads
+    while the solver is already working on the next gun. Every gun in flight
+    owns one simulation folder, the bounded queue of solved guns blocks the
+    solver when the post-processing falls behind.
+    """
+
+    def __init__(self, brain, depth=2, workers=1, export=False, plot=False):
+        self.brain = brain
+        self.depth = depth
+        self.workers = workers
+        self.export = export
+        self.plot = plot
+        self.stats = []
+        self.busy = {}
+        self.wall = 0
+        self.error = None
+        self.lock = threading.Lock()
+        self.plot_lock = threading.Lock()
+
+    def _record(self, stage, t):
+        with self.lock:
+            self.busy[stage] = self.busy.get(stage, 0)+t
+
+    def _post(self, jobs, slots, ys, fast):
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            i, slot, core, stats = job
+            try:
+                t0 = time.time()
+                analyzer = Analyzer(core)
+                if fast:
+                    analyzer.analyze_fast()
+                else:
+                    analyzer.analyze()
+                t1 = time.time()
+                stats['t_analyze'] = t1-t0
+                self._record('analyze', t1-t0)
+                if self.export:
+                    analyzer.export_efield()
+                    t2 = time.time()
+                    stats['t_export'] = t2-t1
+                    self._record('export', t2-t1)
+                if self.plot and not fast:
+                    t2 = time.time()
+                    with self.plot_lock:  # pyplot is not thread safe
+                        analyzer.plot_efield(False, True)
+                    t3 = time.time()
+                    stats['t_plot'] = t3-t2
+                    self._record('plot', t3-t2)
+                ys[i] = slot._cal_err(analyzer.info)
+            except Exception as e:
+                with self.lock:
+                    if self.error is None:
+                        self.error = (i, e)
+            finally:
+                slots.put(slot)
+
+    def map(self, xs, fast=False):
+        """ Test several guns through the pipeline.
+
+        Keyword arguments:
+        xs -- list of cell radii.
+        fast -- [False] use the fast analysis, see Brain.test_gun.
+
+        Returns:
+        ys -- list of test_gun results, in the order of xs.
+        """
+        self.busy = {}
+        self.stats = [{} for x in xs]
+        self.error = None
+        ys = [None]*len(xs)
+
+        # one simulation folder per gun in flight
+        slots = Queue()
+        for i in range(self.depth+self.workers+1):
+            brain = copy.copy(self.brain)
+            brain.name = '{0}-{1}'.format(self.brain.name, i)
+            slots.put(brain)
+        jobs = Queue(maxsize=self.depth)
+        threads = [threading.Thread(target=self._post, args=(jobs, slots, ys, fast))
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        start = time.time()
+        try:
+            for i, x in enumerate(xs):
+                brain = slots.get()
+                if self.error is not None:  # do not keep the solver busy after a failure
+                    break
+                core, stats = brain._solve_gun(x, fast)
+                self.stats[i].update(stats)
+                self._record('gen', stats['t_gen'])
+                self._record('solve', stats['t_solve'])
+                jobs.put((i, brain, core, self.stats[i]))
+        finally:
+            for thread in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+        self.wall = time.time()-start
+
+        if self.error is not None:
+            i, e = self.error
+            raise RuntimeError('Post-processing of gun {} failed!'.format(i)) from e
+        return ys
+
+    def report(self):
+        """ Utilization of every stage in the last map.
+
+        Returns:
+        utilization -- dict of busy time over wall time of every stage, empty before any map.
+        """
+        if not self.wall:
+            return {}
+        return {stage: busy/self.wall for stage, busy in self.busy.items()}
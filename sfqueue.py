@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import threading
+import numpy as np
+
+class SFQueue:
+    """ Shared filesystem job queue for distributing gun evaluations over hosts.
+
+    Jobs and results are json files under root, which must be visible to every
+    worker host. A job lives in pending/ until a worker claims it by renaming
+    it into running/, the result is written to done/ when the worker finishes.
+    All state changes are atomic renames, so the queue needs no lock server.
+    The worker renews the lease of its running job while the solver runs, a
+    job whose lease runs out is taken as lost with its worker and goes back
+    to pending/.
+    """
+
+    def __init__(self, root, poll=0.1, timeout=None, lease=1800):
+        self.root = root
+        self.poll = poll
+        self.timeout = timeout
+        self.lease = lease
+        self.stats = []
+        for folder in ['tmp', 'pending', 'running', 'done']:
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    def _path(self, folder, fname):
+        return os.path.join(self.root, folder, fname)
+
+    def _write(self, folder, fname, data):
+        """ Write a json file into folder atomically.
+        """
+        tmp = self._path('tmp', '{0}.{1}'.format(uuid.uuid4().hex, fname))
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self._path(folder, fname))
+
+    def requeue_stale(self):
+        """ Move the running jobs older than the lease back to pending/.
+        """
+        if self.lease is None:
+            return
+        now = time.time()
+        for fname in os.listdir(self._path('running', '')):
+            job = self._path('running', fname)
+            try:
+                if now-os.path.getmtime(job) > self.lease:
+                    # running jobs are named worker.id.json
+                    os.rename(job, self._path('pending', '.'.join(fname.rsplit('.', 2)[-2:])))
+            except OSError:  # finished or requeued by someone else
+                pass
+
+    def submit(self, brain, x, fast=False):
+        """ Serialize a test_gun request and put it into the queue.
+
+        Keyword arguments:
+        brain -- the Brain that owns the request.
+        x -- cell radii of the gun.
+        fast -- [False] use the fast analysis, see Brain.test_gun.
+
+        Returns:
+        job_id -- id to fetch the result with.
+        """
+        job_id = uuid.uuid4().hex
+        # the workers test the gun locally with the same analysis options
+        options = {}
+        for key, value in (brain.options or {}).items():
+            if key in ['queue', 'pipeline']:
+                continue
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                continue
+            options[key] = value
+        spec = {
+            'id': job_id,
+            'freq': brain.freq,
+            'cell_num': brain.cell_num,
+            'name': brain.name,
+            'x': [float(_x) for _x in x],
+            'geometry': brain.geometry,
+            'options': options,
+            'fast': fast}
+        self._write('pending', job_id+'.json', spec)
+        return job_id
+
+    def fetch(self, job_id):
+        """ Wait for the result of a job and remove it from the queue.
+
+        Keyword arguments:
+        job_id -- id returned by submit.
+
+        Returns:
+        y -- the test_gun result of the job.
+        """
+        return self._fetch(job_id)[0]
+
+    def _fetch(self, job_id):
+        """ Like fetch, also returns the stats of the worker, see SFWorker.
+        """
+        done = self._path('done', job_id+'.json')
+        start = time.time()
+        while not os.path.exists(done):
+            if self.timeout is not None and time.time()-start > self.timeout:
+                raise TimeoutError('Job {} timed out!'.format(job_id))
+            self.requeue_stale()
+            time.sleep(self.poll)
+        with open(done, 'r') as f:
+            result = json.load(f)
+        os.remove(done)
+        if 'error' in result:
+            raise RuntimeError('Job {0} failed: {1}'.format(job_id, result['error']))
+        return np.array(result['y']), result.get('stats', {})
+
+    def map(self, brain, xs, fast=False):
+        """ Evaluate several guns in parallel on the workers.
+
+        Keyword arguments:
+        brain -- the Brain that owns the requests.
+        xs -- list of cell radii.
+        fast -- [False] use the fast analysis, see Brain.test_gun.
+
+        Returns:
+        ys -- list of test_gun results, in the order of xs.
+        """
+        job_ids = [self.submit(brain, x, fast) for x in xs]
+        results = [self._fetch(job_id) for job_id in job_ids]
+        self.stats = [stats for y, stats in results]  # time spent by the workers
+        return [y for y, stats in results]
+
+
+class SFWorker:
+    """ Worker daemon that runs the jobs of a SFQueue.
+
+    The evaluate callable takes the job spec and returns the test_gun result,
+    it may put the time spent on the job into self.stats, which is sent back
+    with the result. The default one reports the Brain.stats of the gun.
+    """
+
+    def __init__(self, root, name=None, evaluate=None, poll=0.1, lease=1800):
+        self.queue = SFQueue(root, poll, lease=lease)
+        self.name = name or '{0}-{1}'.format(socket.gethostname(), os.getpid())
+        self.evaluate = evaluate or self._test_gun
+        self.stats = {}
+
+    def _test_gun(self, spec):
+        from brain import Brain
+
+        # each worker needs its own simulation folder
+        name = '{0}-{1}'.format(spec['name'], self.name)
+        brain = Brain(spec['freq'], spec['cell_num'], name, spec['options'], spec['geometry'])
+        y = brain.test_gun(spec['x'], spec['fast'])
+        self.stats = brain.stats
+        return y
+
+    def _claim(self):
+        """ Claim the oldest pending job.
+
+        Returns:
+        job -- path of the claimed job, None if the queue is empty.
+        """
+        queue = self.queue
+        queue.requeue_stale()
+        pending = []
+        for fname in os.listdir(queue._path('pending', '')):
+            try:
+                pending.append((os.path.getmtime(queue._path('pending', fname)), fname))
+            except OSError:  # taken by another worker
+                pass
+        for mtime, fname in sorted(pending):
+            job = queue._path('running', '{0}.{1}'.format(self.name, fname))
+            try:
+                os.rename(queue._path('pending', fname), job)
+            except OSError:  # taken by another worker
+                continue
+            os.utime(job)  # start the lease
+            return job
+        return None
+
+    def _heartbeat(self, job, stop):
+        """ Renew the lease of a running job until stop is set.
+        """
+        while not stop.wait(self.queue.lease/3):
+            try:
+                os.utime(job)
+            except OSError:  # requeued anyway
+                pass
+
+    def run_once(self):
+        """ Run one job from the queue.
+
+        Returns:
+        ran -- if a job was found.
+        """
+        job = self._claim()
+        if job is None:
+            return False
+
+        with open(job, 'r') as f:
+            spec = json.load(f)
+        self.stats = {}  # set by evaluate if it has any
+        # keep the lease while the solver runs, however long it takes
+        stop = threading.Event()
+        if self.queue.lease is not None:
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop), daemon=True)
+            heartbeat.start()
+        try:
+            y = list(np.asarray(self.evaluate(spec), dtype=float))
+            stats = {key: float(value) for key, value in self.stats.items()}
+            result = {'id': spec['id'], 'y': y, 'stats': stats}
+        except Exception as e:
+            result = {'id': spec['id'], 'error': repr(e)}
+        finally:
+            stop.set()
+        if not os.path.exists(job):  # requeued, the worker that runs it now reports
+            return True
+        self.queue._write('done', spec['id']+'.json', result)
+        try:
+            os.remove(job)
+        except OSError:  # requeued after the lease ran out
+            pass
+        return True
+
+    def run(self, max_jobs=None, idle_timeout=None):
+        """ Keep running jobs from the queue.
+
+        Keyword arguments:
+        max_jobs -- [None] stop after this number of jobs.
+        idle_timeout -- [None] stop after the queue is empty for this long. [s]
+        """
+        count = 0
+        idle = time.time()
+        while max_jobs is None or count < max_jobs:
+            if self.run_once():
+                count += 1
+                idle = time.time()
+            elif idle_timeout is not None and time.time()-idle > idle_timeout:
+                break
+            else:
+                time.sleep(self.queue.poll)
+
+def _fake_test_gun(spec):
+    """ Stand-in for the superfish solver, for testing the queue on one host.
+    """
+    time.sleep(0.2)
+    x = np.array(spec['x'])
+    return x-np.mean(x)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # python sfqueue.py ROOT: start a worker daemon on the shared root
+        SFWorker(sys.argv[1]).run()
+    else:
+        # throughput of local workers with the fake solver
+        import shutil
+        from multiprocessing import Process
+        from brain import Brain
+
+        root = './sfqueue-demo'
+        brain = Brain(11424, 3.6, '3P6GUN')
+        xs = [np.random.rand(5) for i in range(16)]
+        for num in [1, 2, 4, 8]:
+            shutil.rmtree(root, ignore_errors=True)
+            queue = SFQueue(root, poll=0.01)
+            workers = [Process(target=SFWorker(root, 'w{}'.format(i), _fake_test_gun, 0.01).run,
+                               kwargs={'idle_timeout': 1}) for i in range(num)]
+            for worker in workers:
+                worker.start()
+            start = time.time()
+            queue.map(brain, xs)
+            print('{0} worker(s): {1:.2f} jobs/s'.format(num, len(xs)/(time.time()-start)))
+            for worker in workers:
+                worker.join()
+        shutil.rmtree(root, ignore_errors=True)
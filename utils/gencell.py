@@ -1,19 +1,49 @@
-def _get_chamfer(chamfer, direction='x'):
-    """ Calculate chamfer radius.
+import numpy as np
+
+_HALFCELL = ''';{10}
+&PO X={12:.4f} Y={12:.4f}&
+&PO X={12:.4f} Y={0:.4f}&
+&PO X={1:.4f} Y={0:.4f}&
+{11}&PO NT=2 X0={1:.4f} Y0={2:.4f} X={3:.4f} Y={12:.4f} A={3:.4f} B={4:.4f}&
+&PO X={5:.4f} Y={6:.4f}&
+&PO NT=2 X0={7:.4f} Y0={6:.4f} X={12:.4f} Y=-{9:.4f} A={8:.4f} B={9:.4f}&'''.format
+
+_FULLCELL = ''';{16}
+&PO NT=2 X0={0:.4f} Y0={1:.4f} X={2:.4f} Y={18:.4f} A={2:.4f} B={3:.4f}&
+&PO X={4:.4f} Y={5:.4f}&
+{17}&PO NT=2 X0={6:.4f} Y0={5:.4f} X={18:.4f} Y={7:.4f} A={8:.4f} B={7:.4f}&
+&PO X={9:.4f} Y={10:.4f}&
+{17}&PO NT=2 X0={9:.4f} Y0={5:.4f} X={8:.4f} Y={18:.4f} A={8:.4f} B={7:.4f}&
+&PO X={11:.4f} Y={12:.4f}&
+&PO NT=2 X0={13:.4f} Y0={12:.4f} X={18:.4f} Y=-{14:.4f} A={15:.4f} B={14:.4f}&'''.format
+
+_DRIFT_FINAL = ''';{3}
+&PO X={0:.4f} Y={1:.4f}&
+&PO X={0:.4f} Y={2:.4f}&
+&PO X={2:.4f} Y={2:.4f}&'''.format
+
+_DRIFT = ''';{2}
+&PO X={0:.4f} Y={1:.4f}&'''.format
+
+_SETTING = ''';{5}
+&REG KPROB=1 ICYLIN=1
+FREQ={0:.0f}
+XDRI={1:.4f} YDRI={2:.4f}
+DX={3:.4f} DY={4:.4f}&'''.format
+
+def _get_chamfer(chamfer):
+    """ Resolve chamfer radii.
     
     Keyword arguments:
     chamfer -- a float or a two element array-like.
         ex. 1.2 or (0.5, 1.4)
-    direction -- ['x'] which radius to calculate, 'x' or 'y'
     
     Returns:
-    radius -- the radius of the chamfer in the specific direction.
+    radii -- the radii of the chamfer in x and y direction.
     """
-    try:
-        x = chamfer[0]
-        return x if direction == 'x' else chamfer[1]
-    except:
-        return chamfer
+    if np.ndim(chamfer):
+        return chamfer[0], chamfer[1]
+    return chamfer, chamfer
 
 def gen_halfcell(paras, title='Halfcell'):
     """ Generate autofish commands for a halfcell.
@@ -27,29 +57,23 @@ def gen_halfcell(paras, title='Halfcell'):
     """
     l_half = paras['l_half']
     r_half = paras['r_half']
-    c_half = paras['c_half']
-    j_half = paras['j_half']
+    cx, cy = _get_chamfer(paras['c_half'])
+    jx, jy = _get_chamfer(paras['j_half'])
     r_tube = paras['r_tube']
     
-    halfcell = ''';{10}
-&PO X={12:.4f} Y={12:.4f}&
-&PO X={12:.4f} Y={0:.4f}&
-&PO X={1:.4f} Y={0:.4f}&
-{11}&PO NT=2 X0={1:.4f} Y0={2:.4f} X={3:.4f} Y={12:.4f} A={3:.4f} B={4:.4f}&
-&PO X={5:.4f} Y={6:.4f}&
-&PO NT=2 X0={7:.4f} Y0={6:.4f} X={12:.4f} Y=-{9:.4f} A={8:.4f} B={9:.4f}&'''.format(
+    halfcell = _HALFCELL(
         r_half,
-        l_half-_get_chamfer(j_half)-_get_chamfer(c_half),
-        r_half-_get_chamfer(c_half, 'y'),
-        _get_chamfer(c_half),
-        _get_chamfer(c_half, 'y'),
-        l_half-_get_chamfer(j_half),
-        r_tube+_get_chamfer(j_half, 'y'),
+        l_half-jx-cx,
+        r_half-cy,
+        cx,
+        cy,
+        l_half-jx,
+        r_tube+jy,
         l_half,
-        _get_chamfer(j_half),
-        _get_chamfer(j_half, 'y'),
+        jx,
+        jy,
         title,
-        '' if _get_chamfer(c_half)*_get_chamfer(c_half, 'y') else ';',
+        '' if cx*cy else ';',
         0)
     
     return halfcell
@@ -67,38 +91,31 @@ def gen_fullcell(paras, title='Fullcell'):
     p_start = paras['p_start']
     l_full = paras['l_full']
     r_full = paras['r_full']
-    c_full = paras['c_full']
-    j_full_l = paras['j_full_l']
-    j_full_r = paras['j_full_r']
+    cx, cy = _get_chamfer(paras['c_full'])
+    jlx, jly = _get_chamfer(paras['j_full_l'])
+    jrx, jry = _get_chamfer(paras['j_full_r'])
     r_tube_l = paras['r_tube_l']
     r_tube_r = paras['r_tube_r']
     
-    fullcell = ''';{16}
-&PO NT=2 X0={0:.4f} Y0={1:.4f} X={2:.4f} Y={18:.4f} A={2:.4f} B={3:.4f}&
-&PO X={4:.4f} Y={5:.4f}&
-{17}&PO NT=2 X0={6:.4f} Y0={5:.4f} X={18:.4f} Y={7:.4f} A={8:.4f} B={7:.4f}&
-&PO X={9:.4f} Y={10:.4f}&
-{17}&PO NT=2 X0={9:.4f} Y0={5:.4f} X={8:.4f} Y={18:.4f} A={8:.4f} B={7:.4f}&
-&PO X={11:.4f} Y={12:.4f}&
-&PO NT=2 X0={13:.4f} Y0={12:.4f} X={18:.4f} Y=-{14:.4f} A={15:.4f} B={14:.4f}&'''.format(
+    fullcell = _FULLCELL(
             p_start,
-            r_tube_l+_get_chamfer(j_full_l, 'y'),
-            _get_chamfer(j_full_l),
-            _get_chamfer(j_full_l, 'y'),
-            p_start+_get_chamfer(j_full_l),
-            r_full-_get_chamfer(c_full, 'y'),
-            p_start+_get_chamfer(j_full_l)+_get_chamfer(c_full),
-            _get_chamfer(c_full, 'y'),
-            _get_chamfer(c_full),
-            p_start+l_full-_get_chamfer(c_full)-_get_chamfer(j_full_r),
+            r_tube_l+jly,
+            jlx,
+            jly,
+            p_start+jlx,
+            r_full-cy,
+            p_start+jlx+cx,
+            cy,
+            cx,
+            p_start+l_full-cx-jrx,
             r_full,
-            p_start+l_full-_get_chamfer(j_full_r),
-            r_tube_r+_get_chamfer(j_full_r, 'y'),
+            p_start+l_full-jrx,
+            r_tube_r+jry,
             p_start+l_full,
-            _get_chamfer(j_full_r, 'y'),
-            _get_chamfer(j_full_r),
+            jry,
+            jrx,
             title,
-            '' if _get_chamfer(c_full)*_get_chamfer(c_full, 'y') else ';',
+            '' if cx*cy else ';',
             0)
     
     return fullcell
@@ -110,13 +127,9 @@ def gen_drift(paras, title='Drift', final=True):
     p_end = p_start+l_drift
 
     if final:
-        drift = ''';{3}
-&PO X={0:.4f} Y={1:.4f}&
-&PO X={0:.4f} Y={2:.4f}&
-&PO X={2:.4f} Y={2:.4f}&'''.format(p_end, r_right, 0, title)
+        drift = _DRIFT_FINAL(p_end, r_right, 0, title)
     else:
-        drift = ''';{2}
-&PO X={0:.4f} Y={1:.4f}&'''.format(p_end, r_right, title)
+        drift = _DRIFT(p_end, r_right, title)
     
     return drift
 
@@ -127,11 +140,7 @@ def gen_setting(paras, title='Settings'):
     dx = paras['dx']
     dy = paras['dy']
 
-    settings = ''';{5}
-&REG KPROB=1 ICYLIN=1
-FREQ={0:.0f}
-XDRI={1:.4f} YDRI={2:.4f}
-DX={3:.4f} DY={4:.4f}&'''.format(freq, xdri, ydri, dx, dy, title)
+    settings = _SETTING(freq, xdri, ydri, dx, dy, title)
 
     return settings
 
@@ -139,3 +148,114 @@ def gen_title(paras):
     title = paras['title']
 
     return title
+
+def write_gun(f, gun):
+    """ Write the autofish commands of a gun straight to a file.
+
+    Keyword arguments:
+    f -- the file handle.
+    gun -- list of gun elements, see Brain.make_gun.
+    """
+    gen_element = {
+        'title': gen_title,
+        'setting': gen_setting,
+        'halfcell': gen_halfcell,
+        'fullcell': gen_fullcell,
+        'drift': gen_drift}
+    for i, element in enumerate(gun):
+        if i:
+            f.write('\n\n')
+        f.write(gen_element[element['type']](element['paras']))
+
+if __name__ == "__main__":
+    # python -m utils.gencell: compare with the previous generators, which
+    # resolved every chamfer radius on each use and joined the deck in memory
+    import io
+    import random
+    import time
+    from brain import Brain
+
+    def _get_chamfer_legacy(chamfer, direction='x'):
+        try:
+            x = chamfer[0]
+            return x if direction == 'x' else chamfer[1]
+        except:
+            return chamfer
+
+    def gen_halfcell_legacy(paras, title='Halfcell'):
+        l_half, r_half, c_half, j_half, r_tube = [paras[key] for key in
+            ['l_half', 'r_half', 'c_half', 'j_half', 'r_tube']]
+        return _HALFCELL(
+            r_half,
+            l_half-_get_chamfer_legacy(j_half)-_get_chamfer_legacy(c_half),
+            r_half-_get_chamfer_legacy(c_half, 'y'),
+            _get_chamfer_legacy(c_half),
+            _get_chamfer_legacy(c_half, 'y'),
+            l_half-_get_chamfer_legacy(j_half),
+            r_tube+_get_chamfer_legacy(j_half, 'y'),
+            l_half,
+            _get_chamfer_legacy(j_half),
+            _get_chamfer_legacy(j_half, 'y'),
+            title,
+            '' if _get_chamfer_legacy(c_half)*_get_chamfer_legacy(c_half, 'y') else ';',
+            0)
+
+    def gen_fullcell_legacy(paras, title='Fullcell'):
+        p_start, l_full, r_full, c_full, j_full_l, j_full_r, r_tube_l, r_tube_r = [paras[key] for key in
+            ['p_start', 'l_full', 'r_full', 'c_full', 'j_full_l', 'j_full_r', 'r_tube_l', 'r_tube_r']]
+        return _FULLCELL(
+            p_start,
+            r_tube_l+_get_chamfer_legacy(j_full_l, 'y'),
+            _get_chamfer_legacy(j_full_l),
+            _get_chamfer_legacy(j_full_l, 'y'),
+            p_start+_get_chamfer_legacy(j_full_l),
+            r_full-_get_chamfer_legacy(c_full, 'y'),
+            p_start+_get_chamfer_legacy(j_full_l)+_get_chamfer_legacy(c_full),
+            _get_chamfer_legacy(c_full, 'y'),
+            _get_chamfer_legacy(c_full),
+            p_start+l_full-_get_chamfer_legacy(c_full)-_get_chamfer_legacy(j_full_r),
+            r_full,
+            p_start+l_full-_get_chamfer_legacy(j_full_r),
+            r_tube_r+_get_chamfer_legacy(j_full_r, 'y'),
+            p_start+l_full,
+            _get_chamfer_legacy(j_full_r, 'y'),
+            _get_chamfer_legacy(j_full_r),
+            title,
+            '' if _get_chamfer_legacy(c_full)*_get_chamfer_legacy(c_full, 'y') else ';',
+            0)
+
+    def gen_af_legacy(gun):
+        gen_element = {
+            'title': gen_title,
+            'setting': gen_setting,
+            'halfcell': gen_halfcell_legacy,
+            'fullcell': gen_fullcell_legacy,
+            'drift': gen_drift}
+        return '\n\n'.join([gen_element[element['type']](element['paras']) for element in gun])
+
+    def gen_af(gun):
+        f = io.StringIO()
+        write_gun(f, gun)
+        return f.getvalue()
+
+    random.seed(0)
+    guns = []
+    for i in range(5000):
+        brain = Brain(11424, 3.6, '3P6GUN')
+        brain.make_gun([random.uniform(1, 1.2) for j in range(4)])
+        if i % 3 == 0:  # asymmetric chamfers
+            brain.gun[2]['paras']['c_half'] = (random.uniform(0, 0.3), random.uniform(0, 0.3))
+            brain.gun[3]['paras']['j_full_l'] = (random.uniform(0, 0.3), random.uniform(0, 0.3))
+        elif i % 3 == 1:  # numpy scalar chamfers
+            brain.gun[2]['paras']['c_half'] = np.float64(random.uniform(0, 0.3))
+            brain.gun[3]['paras']['c_full'] = np.float64(random.uniform(0, 0.3))
+        guns.append(brain.gun)
+
+    t0 = time.time()
+    legacy = [gen_af_legacy(gun) for gun in guns]
+    t1 = time.time()
+    decks = [gen_af(gun) for gun in guns]
+    t2 = time.time()
+    mismatch = sum([a != b for a, b in zip(legacy, decks)])
+    print('{0} decks: legacy {1:.3f} s, current {2:.3f} s, {3:.2f}x, {4} mismatch(es)'.format(
+        len(guns), t1-t0, t2-t1, (t1-t0)/(t2-t1), mismatch))
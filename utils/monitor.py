@@ -0,0 +1,83 @@
+import json
+import time
+import numpy as np
+
+def jsonl_sink(fname):
+    """ Make a callback that appends every event to a json-lines file.
+
+    Keyword arguments:
+    fname -- the json-lines filename.
+
+    Returns:
+    sink -- the callback, never asks to stop.
+    """
+    def sink(event):
+        with open(fname, 'a') as f:
+            f.write(json.dumps(event)+'\n')
+        return False
+
+    return sink
+
+def no_improvement(k, tol=0):
+    """ Make an early-stop predicate on the residual of the cycles.
+
+    Keyword arguments:
+    k -- stop if the residual has not improved over k cycles.
+    tol -- [0] improvements smaller than tol do not count.
+
+    Returns:
+    predicate -- the callback, True means stop.
+    """
+    best = [np.inf, 0]  # best residual, cycles since it
+
+    def predicate(event):
+        if event['event'] != 'cycle':
+            return False
+        if event['residual'] < best[0]-tol:
+            best[:] = [event['residual'], 0]
+        else:
+            best[1] += 1
+        return best[1] >= k
+
+    return predicate
+
+def cost_budget(budget):
+    """ Make an early-stop predicate on the estimated cost of the seek.
+
+    Keyword arguments:
+    budget -- the time budget. [s]
+
+    Returns:
+    predicate -- the callback, True means stop if the next cycle would exceed the budget.
+    """
+    def predicate(event):
+        if event['event'] != 'cycle':
+            return False
+        cost = event['elapsed']*(event['cycle']+2)/(event['cycle']+1)
+        return cost > budget
+
+    return predicate
+
+def combine(*callbacks):
+    """ Combine several callbacks, the events are sent to all of them.
+
+    Returns:
+    callback -- the combined callback, True if any of the callbacks asks to stop.
+    """
+    def callback(event):
+        stops = [cb(event) for cb in callbacks]
+        return any(stops)
+
+    return callback
+
+def make_event(name, **kwargs):
+    """ Compose a json serializable event.
+    """
+    event = {'event': name, 'timestamp': time.time()}
+    for key, value in kwargs.items():
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        event[key] = value
+    return event
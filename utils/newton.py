@@ -1,7 +1,38 @@
+import time
 import numpy as np
 from utils.roundup import float4
+from utils.monitor import make_event
 
-def seek_root(x, jacob, options=None):
+def _dogleg(y, mat, radius):
+    """ Calculate the dogleg step of the linearized problem within the trust region.
+
+    Keyword arguments:
+    y -- function value
+    mat -- Jacobian matrix
+    radius -- trust region radius
+
+    Returns:
+    dx -- the step, next guess is x-dx
+    """
+    gn = np.linalg.lstsq(mat, y, rcond=None)[0]  # Gauss-Newton step
+    if np.linalg.norm(gn) <= radius:
+        return gn
+
+    g = np.dot(mat.transpose(), y)
+    jg = np.dot(mat, g)
+    sd = np.dot(g, g)/np.dot(jg, jg)*g  # Cauchy step
+    if np.linalg.norm(sd) >= radius:
+        return radius/np.linalg.norm(sd)*sd
+
+    # walk from the Cauchy point towards the Gauss-Newton step until the boundary
+    d = gn-sd
+    a = np.dot(d, d)
+    b = 2*np.dot(sd, d)
+    c = np.dot(sd, sd)-radius**2
+    t = (-b+np.sqrt(b**2-4*a*c))/(2*a)
+    return sd+t*d
+
+def seek_root(x, jacob, options=None, callback=None, func=None):
     """ Seek for the root of a given multi-objection multi-variance function within given accuracy.
     
     Keyword arguments:
@@ -11,6 +42,15 @@ def seek_root(x, jacob, options=None):
         err -- target root accuracy
         max_cycle -- [100] cycle limitation
         eta -- [0.5] relax parameter
+        mode -- ['relax'] 'relax' takes the relaxed Newton step x-eta*dx,
+            'trust' adapts a dogleg step to the actual vs predicted reduction
+        radius -- [None] initial trust region radius, the first Newton step length if None
+        max_trial -- [10] trial step limitation per cycle in trust mode
+    callback -- [None] function called with a dict event after every cycle,
+        seek stops early if it returns True. See utils.monitor for stock callbacks.
+    func -- [None] function that calculate the value only. In trust mode the
+        trial steps are tested with it, and jacob is called as jacob(x, y)
+        to reuse the known value of an accepted step.
     
     Returns:
     x -- final root
@@ -25,30 +65,129 @@ def seek_root(x, jacob, options=None):
         max_cycle = 100
         eta = 0.5
         print('Error reading options, fallback to default settings!')
+    try:
+        mode = options['mode']
+    except KeyError:
+        mode = 'relax'
+    try:
+        radius = options['radius']
+    except KeyError:
+        radius = None
+    try:
+        max_trial = options['max_trial']
+    except KeyError:
+        max_trial = 10
+
+    def emit(name, **kwargs):
+        if callback is None:
+            return False
+        return callback(make_event(name, **kwargs))
 
     cycle = 0
+    start = time.time()
+    known = None  # value at x if already tested
     while True:
-        y, mat = jacob(x)
+        t0 = time.time()
+        if known is None:
+            y, mat = jacob(x)
+        else:
+            y, mat = jacob(x, known)
         print('Cycle {0}: y={1}'.format(cycle, list(y)))
+        stop = emit('cycle', cycle=cycle, x=np.asarray(x, dtype=float), y=y,
+                    residual=np.max(np.abs(y)), time=time.time()-t0, elapsed=time.time()-start)
 
         if not np.sum(np.abs(y) > err):
             print('Succeed! find root in {} cylce(s)!'.format(cycle))
+            emit('end', status='converged', cycle=cycle)
+            return x, y
+
+        if stop:
+            print('Stopped by callback in cycle {}!'.format(cycle))
+            emit('end', status='stopped', cycle=cycle)
             return x, y
 
-        imat = np.linalg.inv(mat)
-        dx = np.dot(y, imat.transpose())
-        _x = float4(x-eta*dx)  # next guess
+        if mode == 'trust':
+            if radius is None:
+                radius = np.linalg.norm(np.linalg.lstsq(mat, y, rcond=None)[0])
+            status = None
+            for trial in range(max_trial):
+                _x = float4(x-_dogleg(y, mat, radius))  # trial guess
+                if np.array_equal(_x, x):
+                    break
+                dx = x-_x
+                _y = jacob(_x)[0] if func is None else func(_x)
+                pred = np.sum(y**2)-np.sum((y-np.dot(mat, dx))**2)
+                rho = (np.sum(y**2)-np.sum(_y**2))/pred if pred > 0 else -1
+                if not np.isfinite(rho):  # nan in the trial value, reject it
+                    rho = -1
+                stop = emit('trial', cycle=cycle, x=_x, y=_y, rho=rho, radius=radius)
+                if rho < 0.25:
+                    radius = 0.25*np.linalg.norm(dx)
+                elif rho > 0.75 and np.linalg.norm(dx) > 0.9*radius:
+                    radius = 2*radius
+                if rho > 0.1:  # accept the trial
+                    known = None if func is None else _y
+                    if stop:
+                        x, y = _x, _y
+                        status = 'stopped'
+                    break
+                if stop:
+                    status = 'stopped'
+                    break
+            else:
+                status = 'max_trial'
+
+            if status == 'stopped':
+                print('Stopped by callback in cycle {}!'.format(cycle))
+                emit('end', status=status, cycle=cycle)
+                return x, y
+            if status == 'max_trial':
+                print('No acceptable step found in {0} trials of cycle {1}!'.format(max_trial, cycle))
+                emit('end', status=status, cycle=cycle)
+                return x, y
+        else:
+            dx = np.linalg.lstsq(mat, y, rcond=None)[0]
+            _x = float4(x-eta*dx)  # next guess
+            known = None
 
         if np.array_equal(_x, x):
             print('The local best solution has been achieved in cycle {}, \
                 however it does not satisfy the accuracy requirements.'.format(cycle))
+            emit('end', status='stalled', cycle=cycle)
             return x, y
 
         if cycle >= max_cycle:
             print('Sorry, can not find solutions with \
                 good enough accuracy in {} cycles!'.format(max_cycle))
+            emit('end', status='max_cycle', cycle=cycle)
             return x, y
         
         x = _x
         cycle += 1
-        
\ No newline at end of file
+        
+if __name__ == "__main__":
+    # python -m utils.newton: count the function calls of both modes on a
+    # nonlinear, ill-conditioned stand-in for the gun
+    rng = np.random.RandomState(0)
+    n = 5
+    q = np.linalg.qr(rng.randn(n, n))[0]
+    A = np.dot(q*np.logspace(0, -2, n), q.transpose())
+    x0 = 1+rng.rand(n)
+    step = 1e-3
+    count = [0]
+
+    def func(x):
+        count[0] += 1
+        d = np.asarray(x)-x0
+        return np.dot(A, d)+2*d**2+np.sin(3*d)
+
+    def jacob(x, y=None):
+        y = func(x) if y is None else y
+        mat = np.array([(func(x+step*e)-y)/step for e in np.eye(n)]).transpose()
+        return y, mat
+
+    for mode in ['relax', 'trust']:
+        count[0] = 0
+        options = {'err': 1e-3, 'max_cycle': 100, 'eta': 0.5, 'mode': mode}
+        x, y = seek_root(np.ones(n), jacob, options, func=func)
+        print('{0}: {1} calls, residual {2:.2e}'.format(mode, count[0], np.max(np.abs(y))))
@@ -0,0 +1,46 @@
+import numpy as np
+
+def tolerance_budget(mat, ytol):
+    """ Linearized tolerance budget of the parameters.
+
+    Every parameter gets the same share of the error budget in the RSS sense,
+    the tolerance of a parameter is limited by its most sensitive output.
+
+    Keyword arguments:
+    mat -- Jacobian matrix, dy/dx
+    ytol -- allowed absolute error of every output, float or array
+
+    Returns:
+    xtol -- tolerance of every parameter, inf if no output depends on it
+    """
+    mat = np.abs(np.asarray(mat))
+    ytol = np.broadcast_to(ytol, mat.shape[0])
+    with np.errstate(divide='ignore'):
+        xtol = ytol[:, np.newaxis]/(np.sqrt(mat.shape[1])*mat)
+    return np.min(xtol, axis=0)
+
+def mc_yield(mat, sigma, ytol, y=None, samples=100000, seed=None):
+    """ Monte-Carlo yield estimation on the linearized model.
+
+    Keyword arguments:
+    mat -- Jacobian matrix, dy/dx
+    sigma -- rms error of every parameter, float or array
+    ytol -- allowed absolute error of every output, float or array
+    y -- [None] output of the nominal parameters, zeros if None
+    samples -- [100000] number of samples
+    seed -- [None] random seed
+
+    Returns:
+    ratio -- fraction of the samples within tolerance
+    dy -- output errors of the samples, samples x outputs
+    """
+    mat = np.asarray(mat)
+    # parameters without effect may have infinite tolerance, do not sample them
+    sigma = np.where(np.any(mat != 0, axis=0), sigma, 0)
+    rng = np.random.RandomState(seed)
+    dx = rng.standard_normal((samples, mat.shape[1]))*sigma
+    dy = np.dot(dx, mat.transpose())
+    if y is not None:
+        dy += y
+    ratio = np.mean(np.all(np.abs(dy) <= ytol, axis=1))
+    return ratio, dy